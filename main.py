@@ -2,18 +2,65 @@
 
 import sys
 import string
-from collections import defaultdict
+from collections import Counter, defaultdict
 import re
 from pathlib import Path
-from typing import Optional
+from typing import Iterable, Optional, Sequence
+
+#######################################################################
+# Bit i of a letter mask is set if chr(ord("a") + i) is possible
+_BIT: dict[str, int] = {
+    char: 1 << num for num, char in enumerate(string.ascii_lowercase)
+}
+_CHAR: dict[int, str] = {bit: char for char, bit in _BIT.items()}
+_ALL_LETTERS = (1 << len(string.ascii_lowercase)) - 1
+
+# Translation tables turning a column of letters into a binary string that
+# has a 1 wherever that letter appears
+_COLUMN_TABLES: list[bytes] = [
+    bytes.maketrans(
+        string.ascii_lowercase.encode(), b"0" * num + b"1" + b"0" * (25 - num)
+    )
+    for num in range(26)
+]
+
+# A line of numbers that are all between 1 and 26
+_PUZZLE_LINE = re.compile(
+    r"\s*(?:(?:[1-9]|1[0-9]|2[0-6])\s+)*(?:[1-9]|1[0-9]|2[0-6])\s*"
+)
+
+# Compiled regexps by pattern, so puzzles that end up with the same pattern
+# share one compile rather than relying on the bounded cache inside re
+_PATTERNS: dict[str, re.Pattern] = {}
+
+# Possibles found for a (puzzle, allowed letters at each position) against one
+# dictionary. The cached dicts are shared, so treat them as read-only
+PossiblesCache = dict[tuple[tuple[int, ...], tuple[int, ...]], dict[int, int]]
+
+
+#######################################################################
+def letters_to_mask(letters: Iterable[str]) -> int:
+    """Convert letters into a mask"""
+    mask = 0
+    for char in letters:
+        mask |= _BIT[char]
+    return mask
+
+
+#######################################################################
+def mask_to_letters(mask: int) -> set[str]:
+    """Convert a mask back into the letters it contains"""
+    return {char for char, bit in _BIT.items() if mask & bit}
 
 
 #######################################################################
 class Letter:
     """Class to store possible answers for a letter"""
 
+    __slots__ = ("_mask", "_answer")
+
     def __init__(self):
-        self._possibles = set(string.ascii_lowercase)
+        self._mask = _ALL_LETTERS
         self._answer = ""
 
     def solve(self, letter: str):
@@ -22,22 +69,28 @@ class Letter:
 
     def possibles(self) -> set[str]:
         """Return possible letters"""
-        return self._possibles
+        return mask_to_letters(self._mask)
 
-    def update(self, possibles: set[str]):
+    def allowed(self) -> int:
+        """Return the mask of letters this could be in a word"""
+        if self._answer:
+            return _BIT[self._answer]
+        return self._mask
+
+    def update(self, mask: int):
         """Update possible letters"""
-        self._possibles &= possibles
+        self._mask &= mask
         self._have_solved()
 
     def _have_solved(self):
         """Check to see if we have solved"""
-        if len(self._possibles) == 1:
-            self.solve(list(self._possibles)[0])
+        if self._mask.bit_count() == 1:
+            self.solve(_CHAR[self._mask])
 
     def remove(self, letter: str):
         """Remove a letter from the possibles"""
-        if letter in self._possibles:
-            self._possibles.remove(letter)
+        if self._mask & _BIT[letter]:
+            self._mask &= ~_BIT[letter]
             self._have_solved()
 
     def answer(self) -> Optional[str]:
@@ -49,10 +102,10 @@ class Letter:
         if self.answer():
             return f"Answer: {self.answer()}"
         else:
-            return f"Possibles: {' '.join(sorted(self._possibles))} ({len(self)})"
+            return f"Possibles: {' '.join(sorted(self.possibles()))} ({len(self)})"
 
     def __len__(self):
-        return len(self._possibles)
+        return self._mask.bit_count()
 
 
 #######################################################################
@@ -62,6 +115,8 @@ class Alphabet:
     def __init__(self):
         """Initialize letters to all possibilities"""
         self._letters: dict[int, Letter] = {}
+        # Letters that haven't been taken by a solved number yet
+        self._available = _ALL_LETTERS
 
         for i in range(1, 27):
             self._letters[i] = Letter()
@@ -76,12 +131,19 @@ class Alphabet:
     def possibles(self, num: int) -> set[str]:
         return self._letters[num].possibles()
 
-    def update(self, num: int, possibles: set[str]):
-        self._letters[num].update(possibles)
+    def position_masks(self, puzzle: list[int]) -> list[int]:
+        """Return the mask of letters allowed at each position of the puzzle"""
+        return [self._letters[num].allowed() for num in puzzle]
+
+    def update(self, num: int, mask: int):
+        self._letters[num].update(mask)
         if ans := self._letters[num].answer():
             self._remove_possibility(ans)
 
     def _remove_possibility(self, char: str):
+        if not self._available & _BIT[char]:  # Already removed everywhere
+            return
+        self._available &= ~_BIT[char]
         for v in self._letters.values():
             v.remove(char)
 
@@ -92,6 +154,80 @@ class Alphabet:
         return self._letters.items()
 
 
+#######################################################################
+class WordIndex:
+    """Dictionary words of a single length, indexed by letter position
+
+    Bit i of a column entry is set if words[i] has that letter at that
+    position, so all the words can be checked against a puzzle with a few
+    big integer operations instead of matching them one at a time
+    """
+
+    def __init__(self, words: list[str]):
+        # Only plain letters can ever be matched
+        self.words = [_ for _ in words if _.isascii() and _.isalpha()]
+        self._word_set = set(self.words)
+        self._all = (1 << len(self.words)) - 1
+        self._columns: list[list[int]] = []
+        self._present: list[int] = []  # Mask of the letters used at each position
+        if not self.words:
+            return
+        length = len(self.words[0])
+        text = "".join(self.words).encode()
+        for pos in range(length):
+            # Reversed so that words[0] ends up as the lowest bit
+            column = text[pos::length][::-1]
+            self._columns.append(
+                [int(column.translate(table), 2) for table in _COLUMN_TABLES]
+            )
+            self._present.append(letters_to_mask(chr(_) for _ in set(column)))
+
+    def scan(self, pos_masks: Sequence[int]) -> int:
+        """Return the set of words that only use the allowed letters at each position"""
+        matches = self._all
+        for column, present, mask in zip(self._columns, self._present, pos_masks):
+            mask &= present
+            if mask == present:  # Nothing at this position is ruled out
+                continue
+            allowed = 0
+            while mask:
+                bit = mask & -mask
+                allowed |= column[bit.bit_length() - 1]
+                mask ^= bit
+            matches &= allowed
+            if not matches:
+                break
+        return matches
+
+    def possibles(self, matches: int, pos_masks: Sequence[int]) -> list[int]:
+        """Return the mask of letters used at each position by the matched words"""
+        masks = []
+        for column, present, allowed in zip(self._columns, self._present, pos_masks):
+            # Matched words can only use the allowed letters
+            candidates = present & allowed
+            mask = 0
+            while candidates:
+                bit = candidates & -candidates
+                if column[bit.bit_length() - 1] & matches:
+                    mask |= bit
+                candidates ^= bit
+            masks.append(mask)
+        return masks
+
+    def matching_words(self, matches: int) -> list[str]:
+        """Return the words in the set of matches"""
+        words = []
+        bits = bin(matches)[:1:-1]  # Lowest bit first
+        pos = bits.find("1")
+        while pos >= 0:
+            words.append(self.words[pos])
+            pos = bits.find("1", pos + 1)
+        return words
+
+    def __contains__(self, word: str) -> bool:
+        return word in self._word_set
+
+
 #######################################################################
 def read_puzzle_file(filename: Path) -> list[str]:
     """Read the puzzle file in"""
@@ -127,6 +263,10 @@ def extract_puzzles(raw_puzzle: list[str]) -> list[list[int]]:
     for line in raw_puzzle:
         if line[0] in string.ascii_letters:
             continue
+        if _PUZZLE_LINE.fullmatch(line):
+            puzzles.append(list(map(int, line.split())))
+            continue
+        # Work out what is wrong with it
         try:
             puzzle = [int(_) for _ in line.split()]
         except ValueError:
@@ -140,27 +280,47 @@ def extract_puzzles(raw_puzzle: list[str]) -> list[list[int]]:
 
 
 #######################################################################
-def load_dictionary(filename: Path) -> list[str]:
-    """Load the dictionary"""
-    dictionary = []
+def load_dictionary(filename: Path) -> dict[int, WordIndex]:
+    """Load the dictionary, bucketed by word length"""
+    dictionary: dict[int, list[str]] = defaultdict(list)
     with open(filename, "r", encoding="utf-8") as dictionary_file:
         for line in dictionary_file:
             if line[0] in string.ascii_lowercase:  # No proper nouns
-                dictionary.append(line.lower().strip())
-    return dictionary
+                word = line.lower().strip()
+                dictionary[len(word)].append(word)
+    return {length: WordIndex(words) for length, words in dictionary.items()}
+
+
+#######################################################################
+def calc_regexp(alphabet: Alphabet, puzzle: list[int]) -> re.Pattern:
+    """Make a regexp to find appropriate words
+    Only depends on the letters allowed at each position, so the same
+    compiled regexp is returned until one of those changes
+    """
+    return _compile_regexp(tuple(puzzle), tuple(alphabet.position_masks(puzzle)))
+
+
+#######################################################################
+def _compile_regexp(puzzle: tuple[int, ...], pos_masks: tuple[int, ...]) -> re.Pattern:
+    """Compile the regexp for a puzzle given the letters allowed at each position"""
+    pattern = _regexp_pattern(puzzle, pos_masks)
+    if pattern not in _PATTERNS:
+        _PATTERNS[pattern] = re.compile(pattern)
+    return _PATTERNS[pattern]
 
 
 #######################################################################
-def calc_regexp(alphabet, puzzle: list[int]) -> re.Pattern:
-    """Make a regexp to find appropriate words"""
-    re_list = ["^"]
-    dupes = set(_ for _ in puzzle if puzzle.count(_) > 1)
+def _regexp_pattern(puzzle: Sequence[int], pos_masks: Sequence[int]) -> str:
+    """Make the regexp pattern for a puzzle given the letters allowed at each
+    position"""
+    re_list = []
+    dupes = {num for num, count in Counter(puzzle).items() if count > 1}
     done_dupes: dict[int, int] = {}
-    for num in puzzle:
-        if ans := alphabet.answer(num):
-            re_list.append(ans)
+    for num, mask in zip(puzzle, pos_masks):
+        if mask in _CHAR:  # Only one possible letter
+            re_list.append(_CHAR[mask])
         else:
-            possible_letters = "".join(sorted(list(alphabet.possibles(num))))
+            possible_letters = "".join(sorted(mask_to_letters(mask)))
             if num in dupes:
                 if num not in done_dupes:
                     reg = f"([{possible_letters}])"
@@ -172,30 +332,60 @@ def calc_regexp(alphabet, puzzle: list[int]) -> re.Pattern:
             re_list.append(reg)
             if not possible_letters:
                 print(f"DBG {num=} {puzzle=} {re_list}")
-    re_list.append("$")
-    reg = re.compile("".join(re_list))
-    return reg
+    return "".join(re_list)
 
 
 #######################################################################
 def get_possibles(
-    puzzle: list[int], reg: re.Pattern, dictionary: list[str]
-) -> dict[int, set[str]]:
-    """Return the possible letters for the puzzle"""
-    possibles: dict[int, set[str]] = defaultdict(set)
+    puzzle: Sequence[int], reg: re.Pattern, words: list[str]
+) -> dict[int, int]:
+    """Return the possible letters for the puzzle as masks"""
+    # Local names to keep attribute and global lookups out of the loop
+    fullmatch = reg.fullmatch
+    bits = _BIT
+    found = [0] * len(puzzle)  # Letters seen at each position
 
     matched = False
-    for word in dictionary:
-        if reg.match(word):
-            for num, char in enumerate(word.strip()):
-                possibles[puzzle[num]].add(char)
+    for word in words:
+        if fullmatch(word):
+            for pos, char in enumerate(word):
+                found[pos] |= bits[char]
             matched = True
     if not matched:  # If we can't match then we can't add value
-        print(f"Couldn't match {reg.pattern}")
         return {}
+    possibles: dict[int, int] = defaultdict(int)
+    for num, mask in zip(puzzle, found):
+        possibles[num] |= mask
     return possibles
 
 
+#######################################################################
+def get_indexed_possibles(
+    puzzle: Sequence[int], pos_masks: Sequence[int], index: WordIndex
+) -> dict[int, int]:
+    """Return the possible letters for a puzzle with no repeated numbers"""
+    matches = index.scan(pos_masks)
+    if not matches:
+        return {}
+    return dict(zip(puzzle, index.possibles(matches, pos_masks)))
+
+
+#######################################################################
+def _puzzle_possibles(
+    puzzle: tuple[int, ...], pos_masks: tuple[int, ...], index: WordIndex
+) -> dict[int, int]:
+    """Return the possible letters for a puzzle given the letters allowed at
+    each position"""
+    if len(set(puzzle)) == len(puzzle):
+        return get_indexed_possibles(puzzle, pos_masks, index)
+    # Repeated numbers need a regexp backreference to check the candidates
+    words = index.matching_words(index.scan(pos_masks))
+    if not words:
+        return {}
+    reg = _compile_regexp(puzzle, pos_masks)
+    return get_possibles(puzzle, reg, words)
+
+
 #######################################################################
 def print_solution(alphabet: Alphabet):
     """Print the solution"""
@@ -213,18 +403,52 @@ def print_solution(alphabet: Alphabet):
 
 #######################################################################
 def solve_iteration(
-    alphabet: Alphabet, puzzles: list[list[int]], dictionary: list[str]
+    alphabet: Alphabet,
+    puzzles: list[list[int]],
+    dictionary: dict[int, WordIndex],
+    cache: Optional[PossiblesCache] = None,
 ) -> None:
     """Solve for all puzzles"""
+    # Each puzzle sees the letters narrowed down by the ones before it, so
+    # they are solved in turn rather than batched into a single scan
     for puzzle in puzzles:
-        solve_puzzle(alphabet, puzzle, dictionary)
+        solve_puzzle(alphabet, puzzle, dictionary, cache)
 
 
 #######################################################################
-def solve_puzzle(alphabet: Alphabet, puzzle: list[int], dictionary: list[str]):
-    """Solve for a single puzzle"""
-    reg = calc_regexp(alphabet, puzzle)
-    possibles = get_possibles(puzzle, reg, dictionary)
+def solve_puzzle(
+    alphabet: Alphabet,
+    puzzle: list[int],
+    dictionary: dict[int, WordIndex],
+    cache: Optional[PossiblesCache] = None,
+):
+    """Solve for a single puzzle
+    If a cache is given, a puzzle whose letters haven't changed since it was
+    last solved against this dictionary reuses its possibles
+    """
+    pos_masks = tuple(alphabet.position_masks(puzzle))
+    index = dictionary.get(len(puzzle))
+    if all(_.bit_count() == 1 for _ in pos_masks):
+        # Nothing left to scan for, just make sure the word exists
+        word = "".join(_CHAR[_] for _ in pos_masks)
+        if not index or word not in index:
+            print(f"Couldn't match {word}")
+            return
+        # Still update so the answers are removed from the other letters
+        for num, mask in zip(puzzle, pos_masks):
+            alphabet.update(num, mask)
+        return
+    possibles: dict[int, int] = {}
+    key = (tuple(puzzle), pos_masks)
+    if cache is not None and key in cache:
+        possibles = cache[key]
+    elif index:
+        possibles = _puzzle_possibles(tuple(puzzle), pos_masks, index)
+        if cache is not None:
+            cache[key] = possibles
+    if not possibles:  # If we can't match then we can't add value
+        print(f"Couldn't match {_regexp_pattern(tuple(puzzle), pos_masks)}")
+        return
     for num, poss in possibles.items():
         alphabet.update(num, poss)
 
@@ -237,8 +461,9 @@ def main():
 
     extract_clues(alphabet, raw_puzzles)
     puzzles = extract_puzzles(raw_puzzles)
+    cache: PossiblesCache = {}
     for _ in range(3):
-        solve_iteration(alphabet, puzzles, dictionary)
+        solve_iteration(alphabet, puzzles, dictionary, cache)
 
     print_solution(alphabet)
 
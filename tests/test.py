@@ -6,6 +6,7 @@ import io
 import re
 import contextlib
 from pathlib import Path
+from unittest.mock import patch
 
 from main import (
     calc_regexp,
@@ -13,9 +14,13 @@ from main import (
     extract_clues,
     extract_puzzles,
     get_possibles,
+    get_indexed_possibles,
+    WordIndex,
     solve_puzzle,
     Letter,
     Alphabet,
+    letters_to_mask,
+    mask_to_letters,
     load_dictionary,
     read_puzzle_file,
 )
@@ -32,24 +37,24 @@ class TestCalcRegex(unittest.TestCase):
     def test_known(self):
         """Test regexp with known letter"""
         reg = calc_regexp(self.alphabet, [1])
-        self.assertEqual(reg.pattern, "^a$")
+        self.assertEqual(reg.pattern, "a")
 
     def test_unknown(self):
         """Test regexp without a known letter"""
         reg = calc_regexp(self.alphabet, [2])
-        self.assertEqual(reg.pattern, "^[bcdefghijklmnopqrstuvwxyz]$")
+        self.assertEqual(reg.pattern, "[bcdefghijklmnopqrstuvwxyz]")
 
     def test_combined(self):
         """Test regexp without a known letter"""
         reg = calc_regexp(self.alphabet, [1, 2])
-        self.assertEqual(reg.pattern, "^a[bcdefghijklmnopqrstuvwxyz]$")
+        self.assertEqual(reg.pattern, "a[bcdefghijklmnopqrstuvwxyz]")
 
     def test_dupe(self):
         """Test regexp with a repeated letter"""
         reg = calc_regexp(self.alphabet, [2, 3, 1, 3])
         self.assertEqual(
             reg.pattern,
-            r"^[bcdefghijklmnopqrstuvwxyz]([bcdefghijklmnopqrstuvwxyz])a\1$",
+            r"[bcdefghijklmnopqrstuvwxyz]([bcdefghijklmnopqrstuvwxyz])a\1",
         )
 
     def test_repeated_dupe(self):
@@ -57,7 +62,23 @@ class TestCalcRegex(unittest.TestCase):
         reg = calc_regexp(self.alphabet, [2, 3, 1, 3, 2, 3])
         self.assertEqual(
             reg.pattern,
-            r"^([bcdefghijklmnopqrstuvwxyz])([bcdefghijklmnopqrstuvwxyz])a\2\1\2$",
+            r"([bcdefghijklmnopqrstuvwxyz])([bcdefghijklmnopqrstuvwxyz])a\2\1\2",
+        )
+
+    def test_cached(self):
+        """Test regexp is reused until the letters change"""
+        reg = calc_regexp(self.alphabet, [2, 3])
+        self.assertIs(calc_regexp(self.alphabet, [2, 3]), reg)
+        self.alphabet.update(3, letters_to_mask("xyz"))
+        reg = calc_regexp(self.alphabet, [2, 3])
+        self.assertEqual(reg.pattern, "[bcdefghijklmnopqrstuvwxyz][xyz]")
+
+    def test_shared(self):
+        """Test puzzles with the same pattern share a compiled regexp"""
+        self.alphabet.update(4, letters_to_mask("xyz"))
+        self.alphabet.update(5, letters_to_mask("xyz"))
+        self.assertIs(
+            calc_regexp(self.alphabet, [1, 4]), calc_regexp(self.alphabet, [1, 5])
         )
 
 
@@ -105,12 +126,18 @@ class TestExtractPuzzles(unittest.TestCase):
             self.assertEqual(ans, [[1, 2, 3]])
             self.assertIn("1 a - couldn't convert", f.getvalue())
 
+    def test_numbers(self):
+        """Test the full range of numbers is accepted"""
+        ans = extract_puzzles(["1 9 10 19 20 26", "  2  3 ", "04 5"])
+        self.assertEqual(ans, [[1, 9, 10, 19, 20, 26], [2, 3], [4, 5]])
+
     def test_bad_numbers(self):
         """Test invalid numbers are reported"""
         f = io.StringIO()
         with contextlib.redirect_stderr(f):
-            ans = extract_puzzles(["1 2 3", "1 27"])
+            ans = extract_puzzles(["1 2 3", "1 27", "0 1"])
             self.assertEqual(ans, [[1, 2, 3]])
+            self.assertIn("0 1 - numbers out of bound", f.getvalue())
             self.assertIn("1 27 - numbers out of bound", f.getvalue())
 
 
@@ -120,25 +147,105 @@ class TestGetPossibles(unittest.TestCase):
 
     def test_match(self):
         """Test a match"""
-        reg = re.compile("^c[aeiou]t$")
+        reg = re.compile("c[aeiou]t")
         ans = get_possibles([1, 2, 3], reg, ["cat", "dog", "cut"])
-        self.assertEqual(ans, {1: {"c"}, 2: {"u", "a"}, 3: {"t"}})
+        self.assertEqual(
+            ans,
+            {
+                1: letters_to_mask("c"),
+                2: letters_to_mask("ua"),
+                3: letters_to_mask("t"),
+            },
+        )
 
     def test_no_match(self):
         """Test where there is no match"""
-        reg = re.compile("^c[aeiou]t$")
+        reg = re.compile("c[aeiou]t")
         ans = get_possibles([1, 2, 3], reg, ["dog", "bird"])
         self.assertEqual(ans, {})
 
 
+########################################################################
+class TestGetIndexedPossibles(unittest.TestCase):
+    """Test get_indexed_possibles()"""
+
+    def setUp(self):
+        self.index = WordIndex(["cat", "dog", "cut"])
+
+    def test_match(self):
+        """Test a match"""
+        pos_masks = [letters_to_mask("c"), letters_to_mask("aeiou"), (1 << 26) - 1]
+        ans = get_indexed_possibles([1, 2, 3], pos_masks, self.index)
+        self.assertEqual(
+            ans,
+            {
+                1: letters_to_mask("c"),
+                2: letters_to_mask("ua"),
+                3: letters_to_mask("t"),
+            },
+        )
+
+    def test_no_match(self):
+        """Test where there is no match"""
+        pos_masks = [letters_to_mask("x"), (1 << 26) - 1, (1 << 26) - 1]
+        ans = get_indexed_possibles([1, 2, 3], pos_masks, self.index)
+        self.assertEqual(ans, {})
+
+
+########################################################################
+class TestWordIndex(unittest.TestCase):
+    """Test WordIndex class"""
+
+    def test_words(self):
+        """Test only plain words are indexed"""
+        index = WordIndex(["cat", "it's", "dog"])
+        self.assertEqual(index.words, ["cat", "dog"])
+
+    def test_scan(self):
+        """Test scan() picks out the matching words"""
+        index = WordIndex(["cat", "dog", "cut"])
+        allowed = (1 << 26) - 1
+        self.assertEqual(index.scan([allowed, allowed, allowed]), 0b111)
+        self.assertEqual(index.scan([letters_to_mask("c"), allowed, allowed]), 0b101)
+        self.assertEqual(index.scan([allowed, letters_to_mask("o"), allowed]), 0b010)
+        self.assertEqual(index.scan([letters_to_mask("x"), allowed, allowed]), 0)
+
+    def test_possibles(self):
+        """Test possibles() gathers letters from the matched words"""
+        index = WordIndex(["cat", "dog", "cut"])
+        allowed = (1 << 26) - 1
+        masks = index.possibles(0b011, [allowed, allowed, allowed])
+        self.assertEqual(
+            [mask_to_letters(_) for _ in masks], [{"c", "d"}, {"a", "o"}, {"t", "g"}]
+        )
+
+    def test_contains(self):
+        """Test checking for a word"""
+        index = WordIndex(["cat", "dog"])
+        self.assertIn("cat", index)
+        self.assertNotIn("cut", index)
+
+    def test_matching_words(self):
+        """Test matching_words() returns the words in a set of matches"""
+        index = WordIndex(["cat", "dog", "cut"])
+        self.assertEqual(index.matching_words(0b101), ["cat", "cut"])
+        self.assertEqual(index.matching_words(0b010), ["dog"])
+        self.assertEqual(index.matching_words(0), [])
+
+    def test_empty(self):
+        """Test an index with no words"""
+        index = WordIndex([])
+        self.assertEqual(index.scan([1, 2]), 0)
+
+
 ########################################################################
 class TestLoadDictionary(unittest.TestCase):
     """Test load_dictionary()"""
 
     def test_load(self):
         ans = load_dictionary(Path("tests/test_dict.txt"))
-        self.assertIn("cat", ans)
-        self.assertNotIn("Arthur", ans)
+        self.assertEqual(ans[3].words, ["dog", "cat"])
+        self.assertNotIn(6, ans)
 
 
 ########################################################################
@@ -156,14 +263,109 @@ class TestSolvePuzzle(unittest.TestCase):
 
     def setUp(self):
         self.alphabet = Alphabet()
+        self.dictionary = {3: WordIndex(["cat", "dog"]), 5: WordIndex(["lemur"])}
 
     def test_solve(self):
         """Solve a puzzle"""
-        solve_puzzle(self.alphabet, [1, 2, 3], ["cat", "dog", "lemur"])
+        solve_puzzle(self.alphabet, [1, 2, 3], self.dictionary)
         self.assertEqual(self.alphabet[1].possibles(), {"c", "d"})
         self.assertEqual(self.alphabet[2].possibles(), {"a", "o"})
         self.assertEqual(self.alphabet[3].possibles(), {"t", "g"})
 
+    def test_unchanged(self):
+        """Puzzles whose letters haven't changed aren't checked again"""
+        cache = {}
+        with patch("main.get_indexed_possibles", wraps=get_indexed_possibles) as mock:
+            for _ in range(3):
+                solve_puzzle(self.alphabet, [1, 2, 3], self.dictionary, cache)
+        self.assertEqual(mock.call_count, 2)
+        self.assertEqual(len(cache), 2)
+        self.assertEqual(self.alphabet[1].possibles(), {"c", "d"})
+
+    def test_no_cache(self):
+        """Without a cache every puzzle is checked"""
+        with patch("main.get_indexed_possibles", wraps=get_indexed_possibles) as mock:
+            for _ in range(3):
+                solve_puzzle(self.alphabet, [1, 2, 3], self.dictionary)
+        self.assertEqual(mock.call_count, 3)
+
+    def test_known(self):
+        """A puzzle with every letter known is only checked against the dictionary"""
+        for num, char in enumerate("cat", 1):
+            self.alphabet.solve(num, char)
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            solve_puzzle(self.alphabet, [1, 2, 3], self.dictionary)
+            solve_puzzle(self.alphabet, [3, 2, 1], self.dictionary)
+        self.assertEqual(f.getvalue(), "Couldn't match tac\n")
+        # Only the found word updates its letters
+        self.assertEqual([len(self.alphabet[_]) for _ in (1, 2, 3)], [0, 0, 0])
+
+    def test_known_propagates(self):
+        """A fully known puzzle still removes its answers from other letters"""
+        dictionary = {1: WordIndex(["a", "b"])}
+        self.alphabet.update(2, letters_to_mask("bc"))
+        self.alphabet[2].remove("c")  # Solved, but not yet removed elsewhere
+        self.assertIn("b", self.alphabet.possibles(3))
+        solve_puzzle(self.alphabet, [2], dictionary)
+        self.assertEqual(self.alphabet.answer(2), "b")
+        self.assertNotIn("b", self.alphabet.possibles(3))
+
+    def test_known_clue(self):
+        """A fully known puzzle updates a clue solved letter"""
+        dictionary = {1: WordIndex(["a", "b"])}
+        self.alphabet.solve(1, "a")
+        self.assertEqual(len(self.alphabet[1]), 25)
+        solve_puzzle(self.alphabet, [1], dictionary)
+        self.assertEqual(self.alphabet.answer(1), "a")
+        self.assertEqual(len(self.alphabet[1]), 0)
+
+    def test_solve_repeated(self):
+        """Solve a puzzle with a repeated number"""
+        dictionary = {3: WordIndex(["cat", "dad", "did"])}
+        solve_puzzle(self.alphabet, [1, 2, 1], dictionary)
+        self.assertEqual(self.alphabet.answer(1), "d")
+        self.assertEqual(self.alphabet[2].possibles(), {"a", "i"})
+
+    def test_no_match_repeated(self):
+        """A repeated puzzle with no candidate words doesn't compile a regexp"""
+        self.alphabet.update(2, letters_to_mask("xz"))
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            with patch("main.re.compile") as mock:
+                solve_puzzle(self.alphabet, [1, 1, 2], self.dictionary)
+        mock.assert_not_called()
+        self.assertIn(r"Couldn't match ([", f.getvalue())
+        self.assertIn(r"\1[xz]", f.getvalue())
+
+    def test_no_match(self):
+        """Solve a puzzle that has no matching words"""
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            with patch("main.re.compile") as mock:
+                solve_puzzle(self.alphabet, [1, 2, 3, 4], self.dictionary)
+        mock.assert_not_called()
+        self.assertIn("Couldn't match", f.getvalue())
+        self.assertEqual(len(self.alphabet[1]), 26)
+
+
+########################################################################
+class TestMasks(unittest.TestCase):
+    """Test letters_to_mask() and mask_to_letters()"""
+
+    def test_letters_to_mask(self):
+        """Test converting letters to a mask"""
+        self.assertEqual(letters_to_mask(""), 0)
+        self.assertEqual(letters_to_mask("a"), 1)
+        self.assertEqual(letters_to_mask("cab"), 0b111)
+        self.assertEqual(letters_to_mask("z"), 1 << 25)
+
+    def test_mask_to_letters(self):
+        """Test converting a mask to letters"""
+        self.assertEqual(mask_to_letters(0), set())
+        self.assertEqual(mask_to_letters(0b101), {"a", "c"})
+        self.assertEqual(mask_to_letters(letters_to_mask("xyz")), {"x", "y", "z"})
+
 
 ########################################################################
 class TestLetter(unittest.TestCase):
@@ -180,17 +382,25 @@ class TestLetter(unittest.TestCase):
         """test update()"""
         l = Letter()
         self.assertEqual(len(l), 26)
-        l.update({"c", "a", "t"})
+        l.update(letters_to_mask("cat"))
         self.assertEqual(len(l), 3)
         self.assertEqual(l.possibles(), {"c", "a", "t"})
-        l.update({"a", "e", "i", "o", "u"})
+        l.update(letters_to_mask("aeiou"))
         self.assertEqual(l.possibles(), {"a"})
         self.assertEqual(l.answer(), "a")
 
+    def test_allowed(self):
+        """Test allowed()"""
+        l = Letter()
+        l.update(letters_to_mask("cat"))
+        self.assertEqual(l.allowed(), letters_to_mask("cat"))
+        l.solve("c")
+        self.assertEqual(l.allowed(), letters_to_mask("c"))
+
     def test_remove(self):
         """Test remove()"""
         l = Letter()
-        l.update({"a", "e", "i", "o", "u"})
+        l.update(letters_to_mask("aeiou"))
         self.assertEqual(len(l), 5)
         l.remove("i")
         self.assertEqual(l.possibles(), {"a", "e", "o", "u"})
@@ -206,6 +416,16 @@ class TestAlphabet(unittest.TestCase):
         a = Alphabet()
         self.assertEqual(len(a[1]), 26)
 
+    def test_position_masks(self):
+        """Test position_masks()"""
+        a = Alphabet()
+        a.solve(1, "a")
+        a.update(2, letters_to_mask("xyz"))
+        self.assertEqual(
+            a.position_masks([1, 2, 1]),
+            [letters_to_mask("a"), letters_to_mask("xyz"), letters_to_mask("a")],
+        )
+
     def test_solve(self):
         """Test solve()"""
         a = Alphabet()
@@ -213,6 +433,17 @@ class TestAlphabet(unittest.TestCase):
         a.solve(1, "a")
         self.assertNotIn("a", a[2].possibles())
 
+    def test_update(self):
+        """Test update() removes a newly solved letter from the others"""
+        a = Alphabet()
+        a.update(1, letters_to_mask("ab"))
+        a.update(2, letters_to_mask("b"))
+        self.assertEqual(a.answer(2), "b")
+        self.assertEqual(a.answer(1), "a")
+        self.assertNotIn("b", a[3].possibles())
+        a.update(3, letters_to_mask("bc"))
+        self.assertEqual(a.answer(3), "c")
+
 
 ########################################################################
 if __name__ == "__main__":  # pragma: no cover